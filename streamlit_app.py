@@ -3,16 +3,45 @@
 import streamlit as st
 import os
 import sys
+import hashlib
+import shutil
+import tempfile
+import traceback
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import TYPE_CHECKING
+import faiss
+import pandas as pd
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+
+def faiss_thread_count() -> int:
+    """FAISS OpenMP thread count from SFL_FAISS_THREADS, defaulting to min(4, CPUs)."""
+    default = min(4, os.cpu_count() or 1)
+    try:
+        threads = int(os.getenv("SFL_FAISS_THREADS", default))
+    except ValueError:
+        threads = default
+    return max(1, threads)
+
+
+# Cap FAISS OpenMP threads so searches don't contend with the Streamlit server
+faiss.omp_set_num_threads(faiss_thread_count())
+
 # Add app directory to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from app.rag_system import BlogPlanningRAG
+# BlogPlanningRAG pulls in torch, sentence-transformers and the Gemini SDK, so it is only
+# imported when an index is actually built (see get_rag)
+if TYPE_CHECKING:
+    from app.rag_system import BlogPlanningRAG
 
 # Page configuration
 st.set_page_config(
@@ -29,18 +58,395 @@ if 'index_built' not in st.session_state:
     st.session_state.index_built = False
 if 'data_file_path' not in st.session_state:
     st.session_state.data_file_path = None
+if 'topic_cache' not in st.session_state:
+    st.session_state.topic_cache = None
+if 'rag_key' not in st.session_state:
+    st.session_state.rag_key = None
+if 'upload_paths' not in st.session_state:
+    st.session_state.upload_paths = {}
+
+# Directory for persisted FAISS indexes and their metadata
+INDEX_CACHE_DIR = Path("cache")
+
+# Reference fields shown in the results table, in display order
+REFERENCE_COLUMNS = ['title', 'subtitle', 'reading_time', 'claps', 'similarity', 'url']
+
+# Keys the final dict from plan_blog_stream must provide
+STREAMED_PLAN_KEYS = ('references', 'num_references')
+
+# Directory for uploaded data files, named by content hash
+UPLOAD_DIR = Path("uploads")
+
+# Chunk size used when copying uploaded files
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Cosine similarity above which a previous topic is treated as the same query
+TOPIC_CACHE_THRESHOLD = 0.9
+
+# Topic cache size above which the flat index is replaced by an HNSW graph
+TOPIC_CACHE_HNSW_MIN_SIZE = 256
+
+# Number of topics used to train int8 scalar quantization of the topic cache
+TOPIC_CACHE_SQ_TRAIN_SIZE = 1000
 
+# Lifetime in seconds and capacity of the exact-match plan cache shared by all sessions
+EXACT_PLAN_TTL = 3600
+EXACT_PLAN_MAX_ENTRIES = 256
 
-def build_index_with_progress(rag: BlogPlanningRAG, data_file: str):
-    """Build index with progress updates."""
+
+@st.cache_resource
+def get_build_executor():
+    """Single worker, shared across reruns, that runs index builds off the script thread."""
+    return ThreadPoolExecutor(max_workers=1)
+
+
+def build_index_with_progress(rag: "BlogPlanningRAG", data_file: str, progress_queue=None):
+    """Build index with progress updates.
+    
+    A stage message is put on ``progress_queue`` when one is given.
+    """
     try:
-        # Build index (progress messages are handled by the spinner in the UI)
+        if progress_queue is not None:
+            progress_queue.put("Embedding documents...")
         rag.build_index(data_file=data_file)
         return True
     except Exception as e:
         raise e
 
 
+@st.cache_data(ttl=30)
+def _default_csv_exists():
+    """Whether the default data file is present.
+    
+    Shared across all sessions and re-checked every 30 seconds.
+    """
+    return os.path.exists("medium_data.csv")
+
+
+@st.cache_data(ttl=30)
+def _gemini_key():
+    """Gemini API key from the environment.
+    
+    Shared across all sessions and re-read every 30 seconds.
+    """
+    return os.getenv("GEMINI_API_KEY")
+
+
+def save_upload(uploaded_file) -> str:
+    """Stream an uploaded file to disk under a content-addressed name.
+    
+    Files already saved with the same content are not written again, so
+    re-uploads map to the same path and reuse the persisted index.
+    """
+    # getbuffer() is a view of the upload, so hashing it does not copy
+    digest = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()[:16]
+    
+    temp_path = UPLOAD_DIR / f"{digest}.csv"
+    if not temp_path.exists():
+        UPLOAD_DIR.mkdir(exist_ok=True)
+        uploaded_file.seek(0)
+        
+        def copy_upload(tmp_path):
+            with open(tmp_path, "wb", buffering=1 << 20) as f:
+                shutil.copyfileobj(uploaded_file, f, length=UPLOAD_CHUNK_SIZE)
+        
+        # Written via a temp file so an interrupted copy never sits under the hash name
+        atomic_write(temp_path, copy_upload)
+    return str(temp_path)
+
+
+# Each cached build holds an embedding model and FAISS index, shared by all sessions
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_rag(data_file: str, batch_size: int, use_gemini: bool, mtime: float, size: int,
+            _progress_queue=None):
+    """Build a RAG system, reused across reruns while the data file is unchanged.
+    
+    ``mtime`` and ``size`` are only part of the cache key so that edits to the
+    data file trigger a rebuild. ``_progress_queue`` is excluded from the key.
+    """
+    from app.rag_system import BlogPlanningRAG
+    
+    rag = BlogPlanningRAG(
+        embedding_batch_size=batch_size,
+        use_gemini=use_gemini
+    )
+    key = index_cache_key(rag, data_file, mtime, size)
+    if key is None or not load_cached_index(rag, key):
+        state = dict(vars(rag))
+        build_index_with_progress(rag, data_file, _progress_queue)
+        if key is not None and built_only_index_state(rag, state):
+            if _progress_queue is not None:
+                _progress_queue.put("Saving index...")
+            try:
+                save_cached_index(rag, data_file, key)
+            except Exception:
+                # The disk cache is an optimisation; the built index is still usable
+                pass
+    return rag
+
+
+# Attributes restored from the disk cache in place of calling build_index
+PERSISTED_INDEX_ATTRS = {"index", "metadata"}
+
+
+def built_only_index_state(rag: "BlogPlanningRAG", state: dict) -> bool:
+    """Whether building ``rag`` only set the attributes the disk cache restores.
+    
+    ``state`` is ``vars(rag)`` from before ``build_index``. If the build set up
+    anything else, a reloaded index would leave ``rag`` half initialised, so it
+    is not persisted.
+    """
+    changed = {
+        name for name, value in vars(rag).items()
+        if name not in state or state[name] is not value
+    }
+    return changed == PERSISTED_INDEX_ATTRS
+
+
+def embedder_name(rag: "BlogPlanningRAG"):
+    """Name of the embedding model used by ``rag``, or None if it cannot be found."""
+    try:
+        name = getattr(rag, "model_name", None)
+        if not name:
+            name = rag.embedder._first_module().auto_model.config.name_or_path
+        dim = rag.embedder.get_sentence_embedding_dimension()
+    except AttributeError:
+        return None
+    return f"{name}|{dim}" if name else None
+
+
+def data_file_key(data_file: str) -> str:
+    """Prefix shared by every persisted index built from ``data_file``."""
+    return hashlib.md5(data_file.encode()).hexdigest()[:16]
+
+
+def index_cache_key(rag: "BlogPlanningRAG", data_file: str, mtime: float, size: int):
+    """Key identifying an index built from a given data file and embedding model.
+    
+    Returns None when the embedding model is unknown, which disables the disk
+    cache rather than risking an index from a different model.
+    """
+    model_name = embedder_name(rag)
+    if model_name is None:
+        return None
+    state = hashlib.md5(f"{mtime}|{size}|{model_name}".encode()).hexdigest()
+    return f"{data_file_key(data_file)}-{state}"
+
+
+def index_cache_paths(key: str):
+    """Paths of the persisted FAISS index and metadata for a cache key."""
+    return INDEX_CACHE_DIR / f"{key}.faiss", INDEX_CACHE_DIR / f"{key}.meta.pkl"
+
+
+def atomic_write(path: Path, write_fn):
+    """Write ``path`` via ``write_fn(tmp_path)`` and move it into place only once complete."""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    os.close(fd)
+    try:
+        write_fn(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_cached_index(rag: "BlogPlanningRAG", key: str) -> bool:
+    """Load a persisted index into ``rag``, memory-mapping it if possible.
+    
+    Unreadable cache files are treated as a miss so the index is rebuilt.
+    """
+    index_path, meta_path = index_cache_paths(key)
+    if not (index_path.exists() and meta_path.exists()):
+        return False
+    try:
+        index = faiss.read_index(
+            str(index_path),
+            faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        )
+        metadata = pd.read_pickle(meta_path)
+    except Exception:
+        return False
+    rag.index = index
+    rag.metadata = metadata
+    return True
+
+
+def save_cached_index(rag: "BlogPlanningRAG", data_file: str, key: str):
+    """Persist the index and metadata of ``rag`` so later runs can skip embedding.
+    
+    Indexes saved for older versions of the same data file are removed.
+    """
+    index_path, meta_path = index_cache_paths(key)
+    INDEX_CACHE_DIR.mkdir(exist_ok=True)
+    atomic_write(index_path, lambda tmp: faiss.write_index(rag.index, tmp))
+    atomic_write(meta_path, lambda tmp: pd.to_pickle(rag.metadata, tmp))
+    
+    for stale in INDEX_CACHE_DIR.glob(f"{data_file_key(data_file)}-*"):
+        if stale not in (index_path, meta_path):
+            stale.unlink(missing_ok=True)
+
+
+def new_topic_cache(rag: "BlogPlanningRAG"):
+    """Create an empty semantic cache of past topics and their plans."""
+    dim = rag.embedder.get_sentence_embedding_dimension()
+    return {
+        "index": faiss.IndexFlatIP(dim),
+        "topics": [],
+        "params": [],
+        "plans": []
+    }
+
+
+def add_to_topic_cache_index(cache: dict, vec):
+    """Add a normalized topic embedding, moving to cheaper indexes as the cache grows.
+    
+    Small caches stay on an exact flat index, which is cheaper below a few
+    hundred entries. Larger caches use an HNSW graph, and once enough topics
+    have been seen to train on, the vectors are stored as int8.
+    """
+    index = cache["index"]
+    index.add(vec)
+    if isinstance(index, faiss.IndexFlat) and index.ntotal > TOPIC_CACHE_HNSW_MIN_SIZE:
+        hnsw = faiss.IndexHNSWFlat(index.d, 32, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = 40
+        hnsw.hnsw.efSearch = 32
+        hnsw.add(index.reconstruct_n(0, index.ntotal))
+        cache["index"] = hnsw
+    elif isinstance(index, faiss.IndexHNSWFlat) and index.ntotal >= TOPIC_CACHE_SQ_TRAIN_SIZE:
+        vectors = index.reconstruct_n(0, index.ntotal)
+        quantized = faiss.IndexHNSWSQ(
+            index.d, faiss.ScalarQuantizer.QT_8bit, 32, faiss.METRIC_INNER_PRODUCT
+        )
+        quantized.hnsw.efConstruction = 40
+        quantized.hnsw.efSearch = 32
+        quantized.train(vectors)
+        quantized.add(vectors)
+        cache["index"] = quantized
+
+
+def lookup_topic_cache(rag: "BlogPlanningRAG", topic: str, num_refs: int, num_sections: int):
+    """Find the plan of a semantically similar past topic in this session's cache.
+    
+    Returns the cached plan (or None) and the topic embedding, so a miss can
+    be stored with ``store_topic_cache`` without embedding the topic again.
+    """
+    cache = st.session_state.topic_cache
+    if cache is None:
+        cache = new_topic_cache(rag)
+        st.session_state.topic_cache = cache
+    
+    params = (num_refs, num_sections)
+    query = topic.strip().lower()
+    vec = rag.embedder.encode([query], normalize_embeddings=True).astype("float32")
+    
+    index = cache["index"]
+    if index.ntotal > 0:
+        scores, ids = index.search(vec, min(index.ntotal, 5))
+        for score, i in zip(scores[0], ids[0]):
+            if i < 0 or score < TOPIC_CACHE_THRESHOLD:
+                break
+            if cache["params"][i] == params:
+                return cache["plans"][i], vec
+    return None, vec
+
+
+def store_topic_cache(topic: str, vec, num_refs: int, num_sections: int, plan: dict):
+    """Add a newly generated plan to this session's semantic topic cache."""
+    # Fallback plans come from a failed Gemini call, so retry them next time
+    if plan.get('model') == 'fallback':
+        return
+    cache = st.session_state.topic_cache
+    add_to_topic_cache_index(cache, vec)
+    cache["topics"].append(topic.strip().lower())
+    cache["params"].append((num_refs, num_sections))
+    cache["plans"].append(plan)
+
+
+def cached_plan_blog(rag: "BlogPlanningRAG", topic: str, num_refs: int, num_sections: int,
+                     plan_fn=None):
+    """Return a blog plan, reusing the plan of a semantically similar past topic.
+    
+    On a cache miss the plan is produced by ``plan_fn`` (``rag.plan_blog`` by
+    default). Returns the plan and whether it came from the cache.
+    """
+    plan, vec = lookup_topic_cache(rag, topic, num_refs, num_sections)
+    if plan is not None:
+        return plan, True
+    
+    plan_fn = plan_fn or rag.plan_blog
+    plan = plan_fn(
+        topic=topic,
+        num_references=num_refs,
+        num_sections=num_sections
+    )
+    store_topic_cache(topic, vec, num_refs, num_sections, plan)
+    return plan, False
+
+
+@st.cache_resource
+def get_exact_plan_cache():
+    """Exact-match plans shared by all sessions, oldest first."""
+    return {"lock": threading.Lock(), "plans": OrderedDict()}
+
+
+def get_exact_plan(key: tuple):
+    """Plan cached for an exact ``(topic, num_refs, num_sections, rag_key)`` key, or None."""
+    cache = get_exact_plan_cache()
+    with cache["lock"]:
+        entry = cache["plans"].get(key)
+        if entry is None:
+            return None
+        plan, expires_at = entry
+        if expires_at < time.monotonic():
+            del cache["plans"][key]
+            return None
+        cache["plans"].move_to_end(key)
+        return plan
+
+
+def put_exact_plan(key: tuple, plan: dict):
+    """Share a newly generated plan with all sessions under its exact key."""
+    # Fallback plans come from a failed Gemini call, so retry them next time
+    if plan.get('model') == 'fallback':
+        return
+    cache = get_exact_plan_cache()
+    with cache["lock"]:
+        cache["plans"][key] = (plan, time.monotonic() + EXACT_PLAN_TTL)
+        cache["plans"].move_to_end(key)
+        while len(cache["plans"]) > EXACT_PLAN_MAX_ENTRIES:
+            cache["plans"].popitem(last=False)
+
+
+def stream_plan_blog(rag: "BlogPlanningRAG", topic: str, num_references: int, num_sections: int):
+    """Generate a blog plan, rendering the Gemini output as it arrives.
+    
+    ``rag.plan_blog_stream`` yields text chunks followed by a dict with the
+    rest of the plan (references, suggested title, ...).
+    """
+    plan = {}
+    
+    def text_chunks():
+        for chunk in rag.plan_blog_stream(
+            topic=topic,
+            num_references=num_references,
+            num_sections=num_sections
+        ):
+            if isinstance(chunk, dict):
+                plan.update(chunk)
+            else:
+                yield chunk
+    
+    st.subheader("Generated Blog Plan")
+    plan['generated_plan'] = st.write_stream(text_chunks())
+    plan.setdefault('topic', topic)
+    
+    # Raise before the plan reaches the topic cache if the stream ended early
+    missing = [k for k in STREAMED_PLAN_KEYS if k not in plan]
+    if missing:
+        raise ValueError(f"Streamed plan is missing {', '.join(missing)}")
+    return plan
+
+
 def main():
     """Main Streamlit app."""
     
@@ -52,7 +458,7 @@ def main():
         st.header("Configuration")
         
         # API Key status
-        api_key = os.getenv("GEMINI_API_KEY")
+        api_key = _gemini_key()
         if api_key:
             st.success("Gemini API Key: Configured")
         else:
@@ -71,7 +477,7 @@ def main():
         
         data_file_path = None
         if data_option == "Use default (medium_data.csv)":
-            if os.path.exists("medium_data.csv"):
+            if _default_csv_exists():
                 data_file_path = "medium_data.csv"
                 st.success(f"Found: medium_data.csv")
             else:
@@ -79,11 +485,12 @@ def main():
         else:
             uploaded_file = st.file_uploader("Upload CSV file", type=["csv"])
             if uploaded_file:
-                # Save uploaded file temporarily
-                temp_path = f"temp_{uploaded_file.name}"
-                with open(temp_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                data_file_path = temp_path
+                # Keep uploads under uploads/ by content hash, hashing each upload once
+                upload_paths = st.session_state.upload_paths
+                data_file_path = upload_paths.get(uploaded_file.file_id)
+                if data_file_path is None or not os.path.exists(data_file_path):
+                    data_file_path = save_upload(uploaded_file)
+                    upload_paths[uploaded_file.file_id] = data_file_path
                 st.success(f"Uploaded: {uploaded_file.name}")
         
         st.session_state.data_file_path = data_file_path
@@ -92,9 +499,9 @@ def main():
         
         # Parameters
         st.subheader("Parameters")
-        num_refs = st.slider("Number of reference blogs", 1, 20, 5)
-        num_sections = st.slider("Number of sections in plan", 3, 10, 5)
-        batch_size = st.slider("Embedding batch size", 1, 8, 8)
+        num_refs = st.number_input("Number of reference blogs", 1, 20, 5, step=1)
+        num_sections = st.number_input("Number of sections in plan", 3, 10, 5, step=1)
+        batch_size = st.number_input("Embedding batch size", 1, 8, 8, step=1)
         
         st.divider()
         
@@ -103,21 +510,43 @@ def main():
             if data_file_path and os.path.exists(data_file_path):
                 try:
                     use_gemini = api_key is not None
-                    rag = BlogPlanningRAG(
-                        embedding_batch_size=batch_size,
-                        use_gemini=use_gemini
-                    )
+                    stat = os.stat(data_file_path)
                     
                     with st.spinner("Building index... This may take a few minutes."):
-                        build_index_with_progress(rag, data_file_path)
+                        progress = queue.Queue()
+                        future = get_build_executor().submit(
+                            get_rag,
+                            data_file_path,
+                            batch_size,
+                            use_gemini,
+                            stat.st_mtime,
+                            stat.st_size,
+                            _progress_queue=progress
+                        )
+                        status = st.empty()
+                        # Keep draining after the build finishes so no message is skipped
+                        while not future.done() or not progress.empty():
+                            try:
+                                status.info(progress.get(timeout=0.5))
+                            except queue.Empty:
+                                pass
+                        status.empty()
+                        rag = future.result()
                     
                     st.session_state.rag_system = rag
+                    st.session_state.rag_key = (
+                        data_file_path,
+                        batch_size,
+                        use_gemini,
+                        stat.st_mtime,
+                        stat.st_size
+                    )
+                    st.session_state.topic_cache = new_topic_cache(rag)
                     st.session_state.index_built = True
                     st.success("Index built successfully!")
                     st.rerun()
                 except Exception as e:
                     st.error(f"Error building index: {str(e)}")
-                    import traceback
                     with st.expander("Error Details"):
                         st.code(traceback.format_exc())
             else:
@@ -138,19 +567,16 @@ def main():
         
         st.divider()
         
-        # Topic input
-        col1, col2 = st.columns([3, 1])
-        with col1:
+        # Topic input (submitted together so typing does not rerun the app)
+        with st.form("gen_form", clear_on_submit=False):
             topic = st.text_input(
                 "Enter blog topic",
                 placeholder="e.g., machine learning, data science, web development",
                 key="topic_input"
             )
+            submitted = st.form_submit_button("Generate Plan", type="primary")
         
-        with col2:
-            generate_button = st.button("Generate Plan", type="primary", use_container_width=True)
-        
-        if generate_button:
+        if submitted:
             if not topic or len(topic.strip()) == 0:
                 st.warning("Please enter a topic")
             else:
@@ -158,20 +584,40 @@ def main():
                 
                 with st.spinner("Generating blog plan..."):
                     try:
-                        plan = rag.plan_blog(
-                            topic=topic,
-                            num_references=num_refs,
-                            num_sections=num_sections
-                        )
-                        
                         # Display results
                         st.divider()
-                        st.header(f"Blog Plan: {plan['topic']}")
+                        header = st.empty()
+                        
+                        # Exact repeats are served from the cache shared by all sessions;
+                        # otherwise try this session's semantic cache, then generate,
+                        # streaming the plan when the RAG system supports it
+                        exact_key = (
+                            topic.strip().lower(),
+                            num_refs,
+                            num_sections,
+                            st.session_state.rag_key
+                        )
+                        plan = get_exact_plan(exact_key)
+                        streamed = False
+                        if plan is None:
+                            can_stream = api_key is not None and hasattr(rag, "plan_blog_stream")
+                            if can_stream:
+                                # Stand-in until the plan, and the topic it was written for, is known
+                                header.header(f"Blog Plan: {topic.strip()}")
+                            plan, cache_hit = cached_plan_blog(
+                                rag, topic, num_refs, num_sections,
+                                plan_fn=(lambda **kwargs: stream_plan_blog(rag, **kwargs)) if can_stream else None
+                            )
+                            if not cache_hit:
+                                streamed = can_stream
+                                put_exact_plan(exact_key, plan)
+                        header.header(f"Blog Plan: {plan['topic']}")
                         
                         # Display generated plan
                         if 'generated_plan' in plan and plan.get('model') != 'fallback':
-                            st.subheader("Generated Blog Plan")
-                            st.markdown(plan['generated_plan'])
+                            if not streamed:
+                                st.subheader("Generated Blog Plan")
+                                st.markdown(plan['generated_plan'])
                             
                             if 'suggested_title' in plan:
                                 st.info(f"**Suggested Title:** {plan['suggested_title']}")
@@ -183,25 +629,25 @@ def main():
                         # Display reference blogs
                         st.subheader(f"Reference Blogs ({plan['num_references']})")
                         
-                        for i, ref in enumerate(plan['references'], 1):
-                            with st.expander(f"{i}. {ref['title']}", expanded=(i == 1)):
-                                if ref.get('subtitle'):
-                                    st.markdown(f"**Subtitle:** {ref['subtitle']}")
-                                
-                                col1, col2, col3 = st.columns(3)
-                                with col1:
-                                    st.metric("Reading Time", f"{ref['reading_time']} min")
-                                with col2:
-                                    st.metric("Claps", ref['claps'])
-                                with col3:
-                                    st.metric("Similarity", f"{ref['similarity']:.3f}")
-                                
-                                if ref.get('url'):
-                                    st.markdown(f"**URL:** {ref['url']}")
+                        refs_df = pd.DataFrame(plan['references']).reindex(columns=REFERENCE_COLUMNS)
+                        st.dataframe(
+                            refs_df,
+                            column_config={
+                                'title': "Title",
+                                'subtitle': "Subtitle",
+                                'reading_time': st.column_config.NumberColumn("Reading Time", format="%d min"),
+                                'claps': "Claps",
+                                'similarity': st.column_config.ProgressColumn(
+                                    "Similarity", min_value=0, max_value=1, format="%.3f"
+                                ),
+                                'url': st.column_config.LinkColumn("URL")
+                            },
+                            hide_index=True,
+                            use_container_width=True
+                        )
                         
                     except Exception as e:
                         st.error(f"Error generating blog plan: {str(e)}")
-                        import traceback
                         with st.expander("Error Details"):
                             st.code(traceback.format_exc())
     